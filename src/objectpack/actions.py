@@ -11,6 +11,7 @@ import warnings
 import six
 
 from django.core import exceptions as dj_exceptions
+from django.db import models as dj_models
 from django.db.models import fields as dj_fields
 from django.utils.encoding import force_text
 from m3 import ApplicationLogicException
@@ -566,6 +567,23 @@ class ObjectRowsAction(BaseAction):
 
         result_dict = {}
 
+        # кэш результатов поиска полей в моделях (на экземпляр action'а,
+        # т.е. на запрос) - метаданные класса не перевычисляются
+        # для каждой строки выборки
+        try:
+            fields_cache = self._prepare_fields_cache
+        except AttributeError:
+            fields_cache = self._prepare_fields_cache = {}
+
+        # кэш строковых представлений связанных объектов по (класс, pk):
+        # __unicode__ связанной модели может выполнять собственные
+        # запросы, поэтому для повторяющихся в выборке объектов
+        # он вызывается лишь единожды
+        try:
+            fk_text_cache = self._prepare_fk_text_cache
+        except AttributeError:
+            fk_text_cache = self._prepare_fk_text_cache = {}
+
         def parse_data_indexes(obj, col, result):
             # сплит строки вида "asdad[.asdasd]" на "голову" и "хвост"
             # "aaa" -> "aaa", None
@@ -583,12 +601,17 @@ class ObjectRowsAction(BaseAction):
                 # --- подиндекса нет - получаем значение
                 # ищем поле в модели
                 if obj:
-                    opts = ModelOptions(obj)
+                    cache_key = (obj.__class__, col)
                     try:
-                        fld = opts.get_field_by_name(col)[0]
-                    except (AttributeError, IndexError,
-                            dj_fields.FieldDoesNotExist):
-                        fld = None
+                        fld = fields_cache[cache_key]
+                    except KeyError:
+                        opts = ModelOptions(obj)
+                        try:
+                            fld = opts.get_field_by_name(col)[0]
+                        except (AttributeError, IndexError,
+                                dj_fields.FieldDoesNotExist):
+                            fld = None
+                        fields_cache[cache_key] = fld
                 else:
                     fld = None
                 # получаем значение
@@ -630,7 +653,15 @@ class ObjectRowsAction(BaseAction):
                     obj = u''
 
                 if not isinstance(obj, (int, bool)):
-                    obj = force_text(obj)
+                    if isinstance(obj, dj_models.Model) and (
+                            obj.pk is not None):
+                        fk_key = (obj.__class__, obj.pk)
+                        try:
+                            obj = fk_text_cache[fk_key]
+                        except KeyError:
+                            obj = fk_text_cache[fk_key] = force_text(obj)
+                    else:
+                        obj = force_text(obj)
                 result[col] = obj
 
         # заполним объект данными по дата индексам
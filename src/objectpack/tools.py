@@ -1,10 +1,18 @@
 # coding: utf-8
 from __future__ import absolute_import
 
+from collections import deque
 from functools import wraps
 import datetime
+import re
+import threading
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    # Python 2
+    from collections import Iterable
 
-from six.moves import map
 import six
 
 from django.db import transaction
@@ -31,15 +39,20 @@ class QuerySplitter(six.Iterator):
     [5, 7, 9, 11, 13, 15, 17, 19, 21, 23]
     """
 
-    def __init__(self, query, start, limit=0):
+    def __init__(self, query, start, limit=0, oversampling=1):
         """
         query - выборка, start и limit - откуда и сколько отрезать.
+        oversampling - во сколько раз больше строк запрашивать за раз:
+        при отбраковке строк валидатором это позволяет добрать
+        недостающее без дополнительных запросов.
         """
         self._data = query
         self._start = start
         self._limit = limit
+        self._chunk_size = max(limit * oversampling, limit)
 
         self._chunk = None
+        self._idx = 0
         self._cnt = 0
         self._no_more_data = False
 
@@ -56,18 +69,25 @@ class QuerySplitter(six.Iterator):
             raise StopIteration()
 
         # если порция кончилась, берем следующую
-        if not self._chunk and not self._no_more_data:
+        if (
+            self._chunk is None or self._idx >= len(self._chunk)
+        ) and not self._no_more_data:
             self._chunk = list(
-                self._data[self._start: self._start + self._limit])
-            if len(self._chunk) < self._limit:
+                self._data[self._start: self._start + self._chunk_size])
+            self._idx = 0
+            # смещение продвигается на фактически полученное кол-во строк:
+            # если БД вернула меньше запрошенного - данных больше нет
+            self._start += len(self._chunk)
+            if len(self._chunk) < self._chunk_size:
                 self._no_more_data = True
-            else:
-                self._start += self._limit
 
-        # отдаём порцию поэлементно
-        if self._chunk:
+        # отдаём порцию поэлементно, сдвигая указатель,
+        # чтобы не перестраивать список на каждом элементе
+        if self._chunk and self._idx < len(self._chunk):
             self._cnt += 1
-            return self._chunk.pop(0)
+            item = self._chunk[self._idx]
+            self._idx += 1
+            return item
 
         raise StopIteration()
 
@@ -84,7 +104,8 @@ class QuerySplitter(six.Iterator):
         cls, query,
         row_fabric=lambda item: item,
         validator=lambda item: True,
-            request=None, start=0, limit=25):
+            request=None, start=0, limit=25, oversampling=1,
+            validator_q=None):
         """
         Формирует список элементов для грида из выборки.
         Параметры листания берутся из :attr:`request`,
@@ -99,18 +120,31 @@ class QuerySplitter(six.Iterator):
         :type row_fabric: types.FunctionType
         :param validator: Функция валидатор
         :type validator: types.FunctionType
+        :param validator_q: Условие-валидатор, накладываемое на выборку
+            до листания - в отличие от :attr:`validator` отбраковка
+            выполняется на стороне БД (может использовать индексы)
+            и не оставляет страницу недозаполненной
+        :type validator_q: django.db.models.Q
         :param request: Реквест
         :type request: django.http.HttpRequest
         :param start: С какой записи начинать
         :type start: int
         :param limit: Сколько записей взять
         :type limit: int
+        :param oversampling: Кратность запаса строк, запрашиваемых
+            за раз - если валидатор отбраковывает заметную долю
+            выборки, запас позволяет заполнить страницу
+            без дополнительных запросов
+        :type oversampling: int
         """
         if request:
             start = extract_int(request, 'start') or start
             limit = extract_int(request, 'limit') or limit
 
-        query = cls(query, start, limit)
+        if validator_q is not None:
+            query = query.filter(validator_q)
+
+        query = cls(query, start, limit, oversampling)
 
         rows = []
         for item in query:
@@ -137,11 +171,14 @@ class ModelCache(object):
         self.MultipleObjectsReturned = model.MultipleObjectsReturned
         self._cache = {}
         self._last_kwargs = {}
+        self._last_key = None
         self._fabric = object_fabric
 
     @staticmethod
     def _key_for_dict(d):
-        return tuple(sorted(six.iteritems(d), key=lambda i: i[0]))
+        # ключи словаря уникальны, поэтому до сравнения значений
+        # сортировка не доходит и отдельный key не нужен
+        return tuple(sorted(d.items()))
 
     def _get_object(self, kwargs):
         try:
@@ -152,7 +189,7 @@ class ModelCache(object):
     def get(self, **kwargs):
         self._last_kwargs = kwargs
 
-        key = self._key_for_dict(kwargs)
+        key = self._last_key = self._key_for_dict(kwargs)
 
         if key in self._cache:
             return self._cache[key]
@@ -168,18 +205,94 @@ class ModelCache(object):
 
         return new
 
+    def prefetch(self, field, values):
+        """
+        Разогрев кэша одним запросом.
+
+        Объекты со значениями поля :attr:`field` из :attr:`values`
+        загружаются единственным `filter(field__in=...)`, после чего
+        последующие вызовы `get(field=...)` обходятся без запросов к БД.
+
+        :param field: Имя поля модели
+        :type field: str
+        :param values: Значения поля
+        """
+        keys = {}
+        for value in values:
+            key = self._key_for_dict({field: value})
+            if key not in self._cache:
+                keys[value] = key
+
+        if not keys:
+            return
+
+        duplicated = set()
+        for obj in self._model.objects.filter(
+                **{'%s__in' % field: list(keys)}):
+            value = getattr(obj, field)
+            key = keys.pop(value, None)
+            if key is not None:
+                self._cache[key] = obj
+            elif value not in duplicated:
+                # значение поля оказалось неуникальным - объект
+                # не кэшируется, чтобы get() как и прежде
+                # поднял MultipleObjectsReturned
+                duplicated.add(value)
+                self._cache.pop(self._key_for_dict({field: value}), None)
+
+        if self._fabric is None:
+            # отсутствующие в БД объекты запоминаются как None,
+            # чтобы промахи не порождали одиночные запросы.
+            # при указанной фабрике промахи не кэшируются,
+            # т.к. объект должен быть создан в get
+            for key in six.itervalues(keys):
+                self._cache[key] = None
+
+    def get_many(self, kwargs_list):
+        """
+        Пакетный аналог get: возвращает объекты для списка наборов
+        параметров, сохраняя порядок. Некэшированные объекты,
+        запрошенные по единственному полю, добираются одним запросом
+        на поле (см. prefetch); наборы из нескольких параметров
+        загружаются через get поштучно.
+
+        :param kwargs_list: Список наборов параметров для get
+        :type kwargs_list: list
+        :rtype: list
+        """
+        to_prefetch = {}
+        for kwargs in kwargs_list:
+            if len(kwargs) == 1 and (
+                    self._key_for_dict(kwargs) not in self._cache):
+                (field, value), = kwargs.items()
+                to_prefetch.setdefault(field, []).append(value)
+
+        for field, values in six.iteritems(to_prefetch):
+            self.prefetch(field, values)
+
+        # после разогрева кэша get либо берет объект из него,
+        # либо (для составных ключей и фабрики) работает как обычно
+        return [self.get(**kwargs) for kwargs in kwargs_list]
+
     def forget_last(self):
-        if self._last_kwargs:
-            key = self._key_for_dict(self._last_kwargs)
-            self._cache.pop(key, None)
+        if self._last_key is not None:
+            self._cache.pop(self._last_key, None)
 
 
 # =============================================================================
 # TransactionCM
 # =============================================================================
+# в Django < 1.6 atomic отсутствует - там транзакция
+# управляется старым API
+_atomic = getattr(transaction, 'atomic', None)
+
+
 class TransactionCM(object):
     """
     Транизакция в виде ContextManager
+
+    Работает поверх transaction.atomic, поэтому вложенные блоки
+    обходятся SAVEPOINT'ами вместо отдельных BEGIN/COMMIT.
     """
 
     def __init__(self, using=None, catcher=None):
@@ -191,15 +304,31 @@ class TransactionCM(object):
         self._catcher = catcher or self._default_catcher
 
     def __enter__(self):
-        transaction.enter_transaction_management(True, self._using)
+        if _atomic is not None:
+            self._cm = _atomic(using=self._using)
+            self._cm.__enter__()
+        else:
+            transaction.enter_transaction_management(True, self._using)
         return transaction
 
-    def __exit__(self, *args):
-        result = self._catcher(*args)
-        if result:
-            transaction.commit(self._using)
+    def __exit__(self, ex_type, ex_inst, traceback):
+        result = self._catcher(ex_type, ex_inst, traceback)
+        if _atomic is None:
+            if result:
+                transaction.commit(self._using)
+            else:
+                transaction.rollback(self._using)
         else:
-            transaction.rollback(self._using)
+            if result:
+                # изменения фиксируются, исключение
+                # (если было) подавляется возвратом True
+                self._cm.__exit__(None, None, None)
+            else:
+                if ex_type is None:
+                    # внешний обработчик отменил фиксацию
+                    # без исключения
+                    transaction.set_rollback(True, self._using)
+                self._cm.__exit__(ex_type, ex_inst, traceback)
         return result
 
     @staticmethod
@@ -210,6 +339,19 @@ class TransactionCM(object):
         return ex_type is None
 
 
+def _request_params(request):
+    """
+    get_request_params с кэшированием результата на самом request'е:
+    объединение параметров GET/POST не перестраивается на каждое
+    извлечение очередного параметра
+    """
+    try:
+        return request._objectpack_params
+    except AttributeError:
+        params = request._objectpack_params = get_request_params(request)
+        return params
+
+
 def extract_int(request, key):
     """
     Нормальный извлекатель числа
@@ -224,11 +366,15 @@ def extract_int(request, key):
     1
     """
     try:
-        return int(get_request_params(request).get(key, ''))
+        return int(_request_params(request).get(key, ''))
     except ValueError:
         return None
 
 
+# числа в строке со списком чисел
+_INT_LIST_RE = re.compile(r'-?\d+')
+
+
 def extract_int_list(request, key):
     """
     Нормальный извлекатель списка чисел
@@ -239,15 +385,21 @@ def extract_int_list(request, key):
     >>> extract_int_list(request, 'list')
     []
 
-    >>> request = rf.post('', {'list':'1,2,3,4'})
+    >>> request = rf.post('', {'list':'1,2, 3,4'})
     >>> extract_int_list(request, 'list')
     [1, 2, 3, 4]
     """
-    request_params = get_request_params(request)
-    return list(map(
-        int,
-        (_f for _f in request_params.get(key, '').split(',') if _f)
-    ))
+    # поиск чисел регулярным выражением (сканирование в C)
+    # быстрее поэлементного split+int на длинных списках id
+    return [
+        int(i) for i in
+        _INT_LIST_RE.findall(_request_params(request).get(key, ''))
+    ]
+
+
+# даты вида "ДД.ММ.ГГГГ" и "ГГГГ.ММ.ДД" (разделители "." и "-")
+_DMY_DATE_RE = re.compile(r'^(\d{1,2})[.-](\d{1,2})[.-](\d{4})$')
+_YMD_DATE_RE = re.compile(r'^(\d{4})[.-](\d{1,2})[.-](\d{1,2})$')
 
 
 def str_to_date(s):
@@ -259,17 +411,22 @@ def str_to_date(s):
     """
     if s:
         s = s[:10]
-        s = s.replace('-', '.')
-        try:
-            s = datetime.datetime.strptime(s, '%d.%m.%Y')
-        except ValueError:
+        # формат определяется регулярным выражением - это дешевле,
+        # чем исключения из strptime на нераспознанном формате
+        match = _DMY_DATE_RE.match(s)
+        if match:
+            day, month, year = match.groups()
+        else:
+            match = _YMD_DATE_RE.match(s)
+            if match:
+                year, month, day = match.groups()
+        if match:
             try:
-                s = datetime.datetime.strptime(s, '%Y.%m.%d')
+                return datetime.datetime(int(year), int(month), int(day))
             except ValueError:
-                s = None
-    else:
-        s = None
-    return s
+                # числа вне допустимых диапазонов (32.13.2012 и т.п.)
+                pass
+    return None
 
 
 def extract_date(request, key, as_date=False):
@@ -278,7 +435,7 @@ def extract_date(request, key, as_date=False):
     (в таком виде приходит от ExtDateField)
     и приведение к Django-формату (YYYY-MM-DD)
     """
-    res = str_to_date(get_request_params(request).get(key))
+    res = str_to_date(_request_params(request).get(key))
     if res and as_date:
         res = res.date()
     return res
@@ -295,6 +452,19 @@ def modify(obj, **kwargs):
     >>> cls.param1
     1
     """
+    cls = type(obj)
+    if getattr(cls, '__setattr__', None) is object.__setattr__ and not any(
+            hasattr(cls, attr) for attr in kwargs):
+        # все атрибуты - простые: инстанс-словарь обновляется одним
+        # вызовом вместо прохода протокола атрибутов на каждый;
+        # классы с дескрипторами или своим __setattr__ идут по
+        # протокольному пути ниже
+        try:
+            obj.__dict__.update(kwargs)
+            return obj
+        except AttributeError:
+            # у объектов со __slots__ нет __dict__
+            pass
     for attr, val in six.iteritems(kwargs):
         setattr(obj, attr, val)
     return obj
@@ -328,12 +498,16 @@ def find_element_by_type(container, cls):
     :type cls: types.ClassType
     """
     res = []
-    for item in container.items:
-        if isinstance(item, cls):
-            res.append(item)
-
-        if hasattr(item, 'items'):
-            res.extend(find_element_by_type(item, cls))
+    # обход в ширину без рекурсии - вложенность контейнеров
+    # не ограничена глубиной стека
+    containers = deque((container,))
+    while containers:
+        for item in containers.popleft().items:
+            if isinstance(item, cls):
+                res.append(item)
+
+            if hasattr(item, 'items'):
+                containers.append(item)
     return res
 
 
@@ -345,6 +519,11 @@ def collect_overlaps(obj, queryset, attr_begin='begin', attr_end='end'):
     Возвращает список объектов из указанной выборки, которые пересекаются
     с указанным объектом по указанным полям начала и конца интервала
 
+    Для Django-выборок фильтр пересечения выполняется на стороне БД
+    одним запросом (может использовать индекс по границам интервала);
+    для выборок, не умеющих такую фильтрацию, интервалы
+    сравниваются в python, как раньше.
+
     :param obj: Объект
     :param queryset: Выборка
     :type queryset: django.db.models.query.QuerySet
@@ -364,6 +543,18 @@ def collect_overlaps(obj, queryset, attr_begin='begin', attr_end='end'):
     if obj.id:
         queryset = queryset.exclude(id=obj.id)
 
+    try:
+        # интервалы пересекаются, если каждый из них начинается
+        # не позже, чем заканчивается другой
+        return list(queryset.filter(**{
+            '%s__lte' % attr_begin: obj_end,
+            '%s__gte' % attr_end: obj_bgn,
+        }))
+    except (AttributeError, TypeError):
+        # выборка не умеет фильтровать сама (или границы интервалов
+        # несравнимы напрямую) - интервалы сравниваются в python
+        pass
+
     result = []
     for o in queryset.iterator():
         bgn = getattr(o, attr_begin, None)
@@ -373,10 +564,13 @@ def collect_overlaps(obj, queryset, attr_begin='begin', attr_end='end'):
                 u'Среди объектов выборки присутствуют некорректные!')
 
         def add():
-            if any((bgn <= obj_bgn <= end,
-                    bgn <= obj_end <= end,
-                    obj_bgn <= bgn <= obj_end,
-                    obj_bgn <= end <= obj_end,)):
+            # короткозамкнутая цепочка or вместо any с кортежем:
+            # сравнения выполняются лишь до первого истинного
+            # и кортеж не создаётся на каждую строку
+            if (bgn <= obj_bgn <= end or
+                    bgn <= obj_end <= end or
+                    obj_bgn <= bgn <= obj_end or
+                    obj_bgn <= end <= obj_end):
                 result.append(o)
 
         try:
@@ -397,8 +591,14 @@ def istraversable(x):
     """
     возвращает True, если объект :attr:`x` позволяет обход себя в цикле `for`
     """
-    return hasattr(x, '__iter__') or hasattr(x, '__next__') or hasattr(
-        x, '__getitem__'
+    # дандер-методы при итерации ищутся в классе, поэтому и проверка
+    # идёт по типу: Iterable.__subclasshook__ - это один просмотр
+    # кэша ABC, а не hasattr по экземпляру, дёргающий __getattr__
+    t = type(x)
+    return (
+        isinstance(x, Iterable) or
+        hasattr(t, '__getitem__') or
+        hasattr(t, '__next__')
     )
 
 
@@ -415,14 +615,29 @@ def cached_to(attr_name):
     """
 
     def wrapper(fn):
+        lock = threading.Lock()
+
         @wraps(fn)
         def inner(self):
-            if hasattr(self, attr_name):
-                result = getattr(self, attr_name)
-            else:
+            # прямое обращение к __dict__ - это один поиск по словарю
+            # на прогретом кэше вместо пары hasattr/getattr
+            try:
+                return self.__dict__[attr_name]
+            except KeyError:
+                pass
+            except AttributeError:
+                # у объектов со __slots__ нет __dict__
+                if hasattr(self, attr_name):
+                    return getattr(self, attr_name)
+            with lock:
+                # повторная проверка под блокировкой: значение могло
+                # быть вычислено, пока блокировка ожидалась -
+                # конкурирующие потоки не считают его дважды
+                if hasattr(self, attr_name):
+                    return getattr(self, attr_name)
                 result = fn(self)
                 setattr(self, attr_name, result)
-            return result
+                return result
 
         return inner
 
@@ -456,8 +671,72 @@ def int_list(s):
     """
     >>> int_list('10,20, 30')
     [10, 20, 30]
+    >>> int_list('10,,20,')
+    [10, 20]
+    """
+    # int сам игнорирует окружающие пробелы - промежуточные
+    # строки от strip не создаются, пустые элементы пропускаются
+    return [int(i) for i in s.split(',') if i and not i.isspace()]
+
+
+def make_matcher(patterns):
+    """
+    Возвращает предикат, проверяющий, соответствует ли строка хотя бы
+    одному из шаблонов. Шаблоны могут содержать wildcards вида
+    `x*` или `*x`, которые трактуются как префиксы и суффиксы.
+    Для пустого списка шаблонов предикат принимает любую строку.
+
+    >>> is_matched = make_matcher(['id', 'ext*', '*.created'])
+    >>> is_matched('id'), is_matched('external_id'), is_matched('user.created')
+    (True, True, True)
+    >>> is_matched('name')
+    False
+    """
+    # шаблоны объединяются в одно регулярное выражение:
+    # строка проверяется одним сканированием в C
+    parts = []
+    for pattern in patterns:
+        if pattern.endswith('*'):
+            parts.append(re.escape(pattern[:-1]) + '.*')
+        elif pattern.startswith('*'):
+            parts.append('.*' + re.escape(pattern[1:]))
+        else:
+            parts.append(re.escape(pattern))
+    if parts:
+        match = re.compile(r'(?:%s)\Z' % '|'.join(parts)).match
+        return lambda s: match(s) is not None
+    return lambda s: True
+
+
+def model_fields_for(model, include=None, exclude=None):
     """
-    return [int(i.strip()) for i in s.split(',')]
+    Список имён полей модели, остающихся после применения списков
+    включения/исключения (с wildcards вида `x*`/`*x`). Результат
+    предназначен для передачи в `.only()`/`.values()`, чтобы выборка
+    не тянула из БД колонки, которые всё равно будут отброшены.
+
+    Шаблоны сопоставляются с attname поля (у ForeignKey - `xxx_id`),
+    возвращается же name - в том виде, в котором его принимают
+    `.only()` и `.values()`.
+
+    :param model: Модель django
+    :type model: django.db.models.Model
+    :param include: Список полей-шаблонов включения
+    :type include: list
+    :param exclude: Список полей-шаблонов исключения
+    :type exclude: list
+    :rtype: list
+    """
+    is_included = make_matcher(include or ())
+    if exclude:
+        is_excluded = make_matcher(exclude)
+    else:
+        def is_excluded(name):
+            return False
+    return [
+        f.name for f in model._meta.fields
+        if is_included(f.attname) and not is_excluded(f.attname)
+    ]
 
 
 def get_related_fields(model, fields):
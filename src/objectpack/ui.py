@@ -684,30 +684,15 @@ def model_fields_to_controls(
     :return: Список контролов для полей модели
     :rtype: list
     """
-    def make_checker(patterns):
-        matchers = []
-        for pattern in patterns:
-            if pattern.endswith('*'):
-                fn = (lambda p: lambda s: s.startswith(p))(pattern[:-1])
-            elif pattern.startswith('*'):
-                fn = (lambda p: lambda s: s.endswith(p))(pattern[1:])
-            else:
-                fn = (lambda p: lambda s: s == p)(pattern)
-            matchers.append(fn)
-        if matchers:
-            return (lambda s: any(fn(s) for fn in matchers))
-        else:
-            return lambda s: True
-
     fields_to_controls = model._meta.fields
 
     if field_list:
         # генерация функции, разрешающей обработку поля
-        is_valid = make_checker(list(field_list or ()))
+        is_valid = tools.make_matcher(list(field_list or ()))
     else:
         # генерация функции, запрещающей обработку поля
         is_valid = (lambda fn: lambda x: not fn(x))(
-            make_checker(list(exclude_list or ()) + [
+            tools.make_matcher(list(exclude_list or ()) + [
                 'created', '*.created',
                 'modified', '*.modified',
                 'external_id', '*.external_id',